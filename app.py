@@ -1,16 +1,61 @@
+import atexit
+import base64
+import gzip
+import hashlib
 import os
-from typing import Optional, Dict, Any, List
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from itertools import islice
+from queue import Empty, SimpleQueue
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+from urllib.parse import parse_qsl
 
-from flask import Flask, request, jsonify
+import orjson
+import requests
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from twilio.request_validator import RequestValidator
 from twilio.rest import Client
+from urllib3.util.retry import Retry
 
 # =========================
 #   CARGA .env
 # =========================
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    jsonify / app.json con orjson (en C) en vez del json de la stdlib.
+    Mismas llaves ordenadas que el provider por defecto; indent sólo en debug.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Werkzeug corta bodies más grandes con 413 antes de leerlos/parsearlos.
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_LENGTH") or 10 * 1024 * 1024)
 
 BACKEND_VERSION = "5.0.0"
 
@@ -23,96 +68,932 @@ AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 if not ACCOUNT_SID or not AUTH_TOKEN:
     raise RuntimeError("Faltan TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN en .env")
 
-client = Client(ACCOUNT_SID, AUTH_TOKEN)
-
 FROM_WHATSAPP = os.getenv("TWILIO_WHATSAPP_FROM")  # ej. whatsapp:+5216565533923
 MSG_SERVICE_SID = os.getenv("TWILIO_MESSAGING_SERVICE_SID")  # opcional
 PUBLIC_BASE_URL = (os.getenv("PUBLIC_BASE_URL") or "").strip()
 
+# PUBLIC_BASE_URL sólo sirve si es https y no es localhost; si no, ''.
+# Se resuelve una vez al importar: el env no cambia en runtime.
+VALID_PUBLIC_BASE = (
+    PUBLIC_BASE_URL.rstrip("/")
+    if PUBLIC_BASE_URL.lower().startswith("https://")
+    and "localhost" not in PUBLIC_BASE_URL
+    and "127.0.0.1" not in PUBLIC_BASE_URL
+    else ""
+)
+STATUS_CALLBACK_URL = f"{VALID_PUBLIC_BASE}/twilio/status" if VALID_PUBLIC_BASE else None
+
+# X-Twilio-Signature de los callbacks: Twilio firma la URL exacta a la que
+# llama, o sea STATUS_CALLBACK_URL; sin ella no hay contra qué validar.
+# TWILIO_VALIDATE_SIGNATURE=0 la desactiva (ej. proxy que reescribe la URL).
+STATUS_SIGNATURE_VALIDATOR = (
+    RequestValidator(AUTH_TOKEN)
+    if STATUS_CALLBACK_URL and os.getenv("TWILIO_VALIDATE_SIGNATURE") != "0"
+    else None
+)
+
+# =========================
+#   REDIS (opcional)
+# =========================
+# Con REDIS_URL el estado compartido vive en Redis (varios workers);
+# sin él todo queda en memoria del proceso.
+REDIS_URL = (os.getenv("REDIS_URL") or "").strip()
+# Tope de conexiones por proceso: los hilos de envío y de gunicorn la
+# comparten; al agotarse un hilo espera REDIS_POOL_TIMEOUT s en vez de
+# abrir conexiones sin límite.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS") or 64)
+REDIS_POOL_TIMEOUT = 5
+
+if REDIS_URL:
+    import redis
+
+    R = redis.Redis(
+        connection_pool=redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            decode_responses=True,
+        )
+    )
+else:
+    R = None
+
+
 # Memoria simple (en producción: DB / Redis)
+# Acotada: pasando STATE_MAX entradas se descartan las usadas hace más tiempo
+# (LRU) para que el proceso no crezca sin límite entre corridas.
+STATE_MAX = int(os.getenv("STATE_MAX") or 200_000)
+RECENT_EVENTS_MAX = int(os.getenv("RECENT_EVENTS_MAX") or 5000)
 STATE = {
-    "sid_to_number": {},   # sid -> e164
-    "delivery": {},        # e164 -> {status, sid, ...}
+    "sid_to_number": OrderedDict(),   # sid -> e164
+    "delivery": OrderedDict(),        # e164 -> DeliveryRecord
     "last_summary": {},
+    # bucket de /report -> set de e164, se mantiene en cada transición
+    "report": {"delivered": set(), "failed": set(), "pending": set()},
+    # últimos callbacks de status (ventana fija, el más nuevo al final)
+    "recent": deque(maxlen=RECENT_EVENTS_MAX),
 }
+STATE_LOCK = threading.Lock()  # el read-modify-write de /twilio/status no es atómico
+
+# Webhooks ya procesados (sid, status), para cuando no hay Redis.
+STATUS_SEEN_TTL = 3600
+STATUS_SEEN_MAX = 100_000
+_status_seen: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+_status_seen_lock = threading.Lock()
+
+
+# =========================
+#   CONCURRENCIA / RATE LIMIT
+# =========================
+# Twilio acepta ~25 mensajes/seg de texto por remitente de WhatsApp
+# (bajarlo si el remitente tiene un límite menor, p.ej. media).
+TWILIO_MPS = float(os.getenv("TWILIO_MPS") or 25)
+if not TWILIO_MPS > 0:  # también NaN; el token bucket divide entre esto
+    raise RuntimeError(f"TWILIO_MPS debe ser > 0 (es {TWILIO_MPS})")
+
+# Envíos en vuelo a la vez. Cada envío es un round-trip HTTPS bloqueante,
+# así que con hilos el lote tarda ~lo que el envío más lento y no la suma.
+TWILIO_CONCURRENCY = int(os.getenv("TWILIO_CONCURRENCY") or max(1, round(TWILIO_MPS)))
+
+SEND_EXECUTOR = ThreadPoolExecutor(max_workers=TWILIO_CONCURRENCY, thread_name_prefix="twilio-send")
+
+# Lotes en segundo plano ("background": true): cada job hace su fan-out en
+# SEND_EXECUTOR; el token bucket es global, así que varios jobs a la vez
+# tampoco pasan de TWILIO_MPS.
+BULK_JOB_WORKERS = int(os.getenv("BULK_JOB_WORKERS") or 2)
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=BULK_JOB_WORKERS, thread_name_prefix="bulk-job")
+
+# Envíos: POST directo a la REST API con una sesión HTTP compartida
+# (keep-alive, el handshake TLS se paga una vez por conexión del pool).
+# El SDK se queda para lo demás (p.ej. /status-detail) y usa la misma sesión.
+TWILIO_MESSAGES_URL = f"https://api.twilio.com/2010-04-01/Accounts/{ACCOUNT_SID}/Messages.json"
+TWILIO_HTTP_TIMEOUT = 10
+
+# 429 (Too Many Requests): Twilio no creó el mensaje, así que reintentar el
+# POST es seguro. Backoff exponencial con jitter (o el Retry-After que mande).
+TWILIO_429_RETRIES = 5
+TWILIO_429_BACKOFF_MAX = 8.0
+SEND_WINDOW = 100  # rows por ventana en send_rows
+SEND_WINDOW_429_RATIO = 0.1  # >10% rate_limited en una ventana -> pausa
+
+# Basic auth armado una vez: con una tupla en session.auth requests lo
+# recodifica (latin-1 + base64) en cada request.
+TWILIO_AUTH_HEADER = "Basic " + base64.b64encode(f"{ACCOUNT_SID}:{AUTH_TOKEN}".encode()).decode()
+
+
+class _TwilioAuth(requests.auth.AuthBase):
+    # Se deja como auth (y no como header de la sesión) para que requests no
+    # busque credenciales en ~/.netrc en cada request.
+    def __call__(self, r):
+        r.headers["Authorization"] = TWILIO_AUTH_HEADER
+        return r
+
+
+HTTP = requests.Session()
+HTTP.auth = _TwilioAuth()
+# urllib3 no reintenta POST por status (duplicaría mensajes); sí reintenta
+# fallas de conexión, que ocurren antes de que Twilio reciba nada.
+HTTP.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=50,
+        pool_maxsize=max(50, TWILIO_CONCURRENCY),
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    ),
+)
+
+_twilio_http = TwilioHttpClient(timeout=TWILIO_HTTP_TIMEOUT)
+_twilio_http.session = HTTP
+client = Client(ACCOUNT_SID, AUTH_TOKEN, http_client=_twilio_http)
+
+_bucket_lock = threading.Lock()
+_bucket_tokens = float(TWILIO_MPS)
+_bucket_ts = time.monotonic()
 
 
 # =========================
 #   UTILIDADES
 # =========================
-def valid_public_base() -> str:
+def json_dumps(obj: Any) -> str:
+    """json.dumps compacto vía orjson (C), para content_variables y Redis."""
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def read_json_body() -> Dict[str, Any]:
     """
-    Devuelve PUBLIC_BASE_URL si es https y no es localhost; si no, ''.
+    Body del request parseado con orjson (más rápido que request.get_json
+    en lotes grandes). Body vacío o que no es objeto -> {}.
+    Lanza orjson.JSONDecodeError si no es JSON válido.
     """
-    base = PUBLIC_BASE_URL
-    if base.lower().startswith("https://") and "localhost" not in base and "127.0.0.1" not in base:
-        return base.rstrip("/")
-    return ""
+    raw = request.get_data(cache=False)  # se parsea una sola vez
+    if not raw:
+        return {}
+    data = orjson.loads(raw)
+    return data if isinstance(data, dict) else {}
 
 
-def normalize_to_e164_mx(raw_number: str) -> str:
+_NON_DIGITS_RE = re.compile(r"\D")
+# Texto ASCII (lo normal): str.translate borra los separadores más rápido
+# que la regex. Con caracteres no ASCII se usa _NON_DIGITS_RE, igual que antes.
+_ASCII_NON_DIGITS = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit()))
+_MX_RE = re.compile(r"(?:52)?(\d{10})")
+_E164_RE = re.compile(r"\+[1-9]\d{7,14}")
+
+
+def _only_digits(text: str) -> str:
+    if text.isascii():
+        return text.translate(_ASCII_NON_DIGITS)
+    return _NON_DIGITS_RE.sub("", text)
+
+
+def _parse_e164_mx(raw_number: str) -> str:
     """
     Normaliza número mexicano a E.164 SIN usar phonenumbers.
     Reglas simples:
-      - Si ya empieza con '+', lo dejamos tal cual.
+      - Si ya empieza con '+', se valida como E.164 (quitando separadores).
       - Si son 10 dígitos -> +52 + número
       - Si son 12 dígitos y empieza con '52' -> + + número
     Si no cumple, lanza ValueError.
+    El filtrado de dígitos y la validación corren en C (str.translate y
+    regex precompiladas).
     """
-    raw = str(raw_number).strip()
+    raw = raw_number.strip() if isinstance(raw_number, str) else str(raw_number).strip()
 
-    # Ya viene en formato +...
+    # Ya viene en formato +... (cualquier país); sólo se valida la forma
     if raw.startswith("+"):
-        return raw
+        if _E164_RE.fullmatch(raw):
+            return raw
+        compact = "+" + _only_digits(raw[1:])
+        if _E164_RE.fullmatch(compact):
+            return compact
+        raise ValueError(f"No parece número E.164 válido: {raw_number}")
 
-    # Sólo dígitos
-    digits = "".join(ch for ch in raw if ch.isdigit())
+    # Camino rápido: ya son sólo dígitos ASCII (el caso común)
+    if raw.isascii() and raw.isdigit():
+        n = len(raw)
+        if n == 10:
+            return "+52" + raw
+        if n == 12 and raw.startswith("52"):
+            return "+" + raw
+        raise ValueError(f"No parece número MX válido: {raw_number}")
 
-    if len(digits) == 10:
-        # asumimos MX
-        return "+52" + digits
-    if len(digits) == 12 and digits.startswith("52"):
-        return "+" + digits
+    # Con separadores: sólo dígitos; 10 (asumimos MX) o 12 con prefijo 52
+    m = _MX_RE.fullmatch(_only_digits(raw))
+    if m:
+        return "+52" + m.group(1)
 
     raise ValueError(f"No parece número MX válido: {raw_number}")
 
 
-def with_whatsapp_prefix(e164: str) -> str:
-    return f"whatsapp:{e164}"
+@lru_cache(maxsize=65536)  # los mismos números se repiten entre lotes
+def _normalize_cached(raw_number: str) -> Tuple[Optional[str], Optional[str]]:
+    # (e164, None) o (None, error): también los inválidos quedan cacheados
+    try:
+        return _parse_e164_mx(raw_number), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def normalize_to_e164_mx(raw_number: str) -> str:
+    """Como _parse_e164_mx, con cache; lanza ValueError si no es válido."""
+    e164, error = _normalize_cached(raw_number)
+    if error is not None:
+        raise ValueError(error)
+    return e164
+
+
+LoteRow = Tuple[str, str, Dict[str, Any]]  # (raw_str, e164, vars)
+
+
+def normalize_lotes(
+    lotes: List[Dict[str, Any]],
+) -> Tuple[List[LoteRow], List[str], List[Dict[str, str]]]:
+    """
+    Normaliza todos los lotes en una sola pasada, sin tocar la red.
+    Devuelve (rows, invalid_by_norm, duplicates_collapsed) con
+    rows = [(raw_str, e164, vars), ...].
+    Un mismo E.164 se envía una sola vez (gana el primer lote, en orden);
+    los repetidos van a duplicates_collapsed. Los inválidos se agrupan por
+    el texto crudo.
+    """
+    rows: List[LoteRow] = []
+    invalid_by_norm: List[str] = []
+    duplicates_collapsed: List[Dict[str, str]] = []
+    seen: Dict[str, str] = {}         # e164 -> raw_str del primero
+    seen_invalid: Dict[str, None] = {}
+    # alias locales: el bucle corre una vez por número
+    normalize = normalize_to_e164_mx
+    add_row = rows.append
+
+    for lote in lotes:
+        raw_str = str(lote.get("telefono", "")).strip()
+        if not raw_str:
+            continue
+
+        try:
+            e164 = normalize(raw_str)
+        except ValueError as e:
+            if raw_str not in seen_invalid:
+                seen_invalid[raw_str] = None
+                invalid_by_norm.append(f"{raw_str} ({e})")
+            continue
+
+        first = seen.get(e164)
+        if first is not None:
+            duplicates_collapsed.append(
+                {"numero": raw_str, "e164": e164, "kept": first}
+            )
+            continue
+        seen[e164] = raw_str
+        add_row((raw_str, e164, lote.get("vars") or {}))
+
+    return rows, invalid_by_norm, duplicates_collapsed
+
+
+def wait_send_slot() -> None:
+    """
+    Token bucket: bloquea hasta que haya cupo para un envío sin pasar
+    de TWILIO_MPS por segundo (evita 429 de Twilio).
+    Cada llamada reserva su token de una vez (el saldo puede quedar
+    negativo) y duerme fuera del lock lo que le toca esperar.
+    """
+    global _bucket_tokens, _bucket_ts
+    with _bucket_lock:
+        now = time.monotonic()
+        _bucket_tokens = min(TWILIO_MPS, _bucket_tokens + (now - _bucket_ts) * TWILIO_MPS)
+        _bucket_ts = now
+        _bucket_tokens -= 1
+        wait = -_bucket_tokens / TWILIO_MPS if _bucket_tokens < 0 else 0.0
+    if wait:
+        time.sleep(wait)
+
+
+# =========================
+#   ESTADO DE ENTREGAS
+# =========================
+# En Redis:
+#   sid:{sid}          -> e164 (string con TTL)
+#   delivery:{e164}    -> hash {status, sid, channel, template, vars(JSON), ...}
+#   report:{bucket}    -> set de e164 por bucket de /report
+SID_TTL = 86400
+# Después de estos Twilio ya no manda más callbacks para el sid
+# (en WhatsApp "delivered" todavía puede pasar a "read").
+FINAL_STATUSES = ("read", "failed", "undelivered", "canceled")
+REPORT_SETS = {
+    "delivered": "report:delivered",
+    "failed": "report:failed",
+    "pending": "report:pending",
+}
+RECENT_KEY = "report:recent"  # lista, el más nuevo primero
+
+
+@dataclass(slots=True)
+class DeliveryRecord:
+    """Registro de entrega por número (con slots: sin __dict__ por instancia)."""
+
+    status: Optional[str]
+    sid: Optional[str] = None
+    channel: str = "whatsapp"
+    template: Optional[str] = None
+    vars: Optional[Dict[str, Any]] = None
+    reason: Optional[str] = None
+    error_code: Optional[str] = None
+    error_message: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dict para JSON/Redis; omite los campos en None."""
+        return {
+            name: value
+            for name in self.__slots__
+            if (value := getattr(self, name)) is not None
+        }
+
+
+def report_bucket(status: Optional[str]) -> str:
+    """Bucket de /report para un status de Twilio."""
+    if status == "delivered":
+        return "delivered"
+    if status in ("failed", "undelivered", "failed_on_send", "rate_limited"):
+        return "failed"
+    return "pending"
+
+
+def _redis_fields(record: DeliveryRecord) -> Dict[str, str]:
+    # Redis sólo guarda strings: vars va como JSON y los None se omiten.
+    return {
+        k: (json_dumps(v) if k == "vars" else str(v))
+        for k, v in record.to_dict().items()
+    }
+
+
+def _redis_move(pipe, e164: str, status: Optional[str]) -> None:
+    bucket = report_bucket(status)
+    for name, key in REPORT_SETS.items():
+        if name == bucket:
+            pipe.sadd(key, e164)
+        else:
+            pipe.srem(key, e164)
+
+
+def _memory_move(e164: str, status: Optional[str]) -> None:
+    # llamar con STATE_LOCK tomado
+    bucket = report_bucket(status)
+    for name, members in STATE["report"].items():
+        if name == bucket:
+            members.add(e164)
+        else:
+            members.discard(e164)
+
+
+def _memory_put_sid(sid: str, e164: str) -> None:
+    # llamar con STATE_LOCK tomado
+    sids = STATE["sid_to_number"]
+    sids[sid] = e164
+    sids.move_to_end(sid)
+    if len(sids) > STATE_MAX:
+        sids.popitem(last=False)
+
+
+def _memory_put(e164: str, record: DeliveryRecord) -> None:
+    # llamar con STATE_LOCK tomado; el número desalojado sale también de /report
+    delivery = STATE["delivery"]
+    delivery[e164] = record
+    delivery.move_to_end(e164)
+    _memory_move(e164, record.status)
+    if len(delivery) > STATE_MAX:
+        evicted, _ = delivery.popitem(last=False)
+        for members in STATE["report"].values():
+            members.discard(evicted)
+
+
+REDIS_FLUSH_EVERY = 100  # escrituras por pipeline (~6 comandos cada una)
+
+DeliveryWrite = Tuple[str, DeliveryRecord, Optional[str]]  # (e164, record, sid)
+
+
+def track_deliveries(writes: List[DeliveryWrite]) -> None:
+    """
+    Guarda (reemplaza) varios registros de entrega con un solo pipeline de
+    Redis (o un solo lock en memoria). sid puede ser None si no hubo envío.
+    """
+    if not writes:
+        return
+
+    if R is not None:
+        # MULTI: /report nunca ve un delivery:{e164} a medio reemplazar
+        pipe = R.pipeline()
+        for i, (e164, record, sid) in enumerate(writes, 1):
+            if sid:
+                pipe.set(f"sid:{sid}", e164, ex=SID_TTL)
+            pipe.delete(f"delivery:{e164}")
+            pipe.hset(f"delivery:{e164}", mapping=_redis_fields(record))
+            _redis_move(pipe, e164, record.status)
+            if i % REDIS_FLUSH_EVERY == 0:
+                pipe.execute()
+        pipe.execute()
+        return
+
+    with STATE_LOCK:
+        for e164, record, sid in writes:
+            if sid:
+                _memory_put_sid(sid, e164)
+            _memory_put(e164, record)
+
+
+def track_delivery(e164: str, record: DeliveryRecord, sid: Optional[str] = None) -> None:
+    """
+    Guarda (reemplaza) el registro de entrega de e164 y, si hubo envío,
+    el mapeo sid -> e164 que usa /twilio/status.
+    """
+    track_deliveries([(e164, record, sid)])
+
+
+def _status_event(
+    sid: str,
+    e164: str,
+    status: Optional[str],
+    error_code: Optional[str],
+) -> Dict[str, Any]:
+    event = {"ts": int(time.time()), "sid": sid, "e164": e164, "status": status}
+    if error_code:
+        event["error_code"] = error_code
+    return event
+
+
+def apply_status(
+    sid: str,
+    status: Optional[str],
+    error_code: Optional[str],
+    error_msg: Optional[str],
+) -> None:
+    """
+    Aplica un callback de status de Twilio al registro del número y lo
+    anota en la ventana de eventos recientes de /report.
+    """
+    if R is not None:
+        e164 = R.get(f"sid:{sid}")
+        if not e164:
+            return
+        fields = {"status": status or "", "sid": sid}
+        if error_code or error_msg:
+            fields["error_code"] = error_code or ""
+            fields["error_message"] = error_msg or ""
+        pipe = R.pipeline()
+        pipe.hset(f"delivery:{e164}", mapping=fields)
+        _redis_move(pipe, e164, status)
+        pipe.lpush(RECENT_KEY, json_dumps(_status_event(sid, e164, status, error_code)))
+        pipe.ltrim(RECENT_KEY, 0, RECENT_EVENTS_MAX - 1)
+        if status in FINAL_STATUSES:
+            pipe.delete(f"sid:{sid}")  # no esperar al TTL
+        pipe.execute()
+        return
+
+    with STATE_LOCK:
+        e164 = STATE["sid_to_number"].get(sid)
+        if e164:
+            current = STATE["delivery"].get(e164)
+            if current is None:
+                current = DeliveryRecord(status=None)
+            elif (
+                current.status == status
+                and current.sid == sid
+                and not error_code
+                and not error_msg
+            ):
+                return  # nada cambió (reintento de Twilio)
+            # registro nuevo: /report puede estar serializando el anterior
+            changes: Dict[str, Any] = {"status": status, "sid": sid}
+            if error_code or error_msg:
+                changes["error_code"] = error_code
+                changes["error_message"] = error_msg
+            _memory_put(e164, replace(current, **changes))
+            STATE["recent"].append(_status_event(sid, e164, status, error_code))
+            if status in FINAL_STATUSES:
+                # el mapeo ya no se va a usar: no ocupar lugar en el LRU
+                del STATE["sid_to_number"][sid]
+
+
+def recent_events() -> List[Dict[str, Any]]:
+    """
+    Últimos status aplicados, el más nuevo primero. Con coalescencia
+    (STATUS_COALESCE_MS > 0) sólo queda el último status de cada sid por
+    ventana: los intermedios (sent/delivered antes de read) no aparecen.
+    """
+    if R is not None:
+        return [orjson.loads(raw) for raw in R.lrange(RECENT_KEY, 0, -1)]
+
+    with STATE_LOCK:
+        events = list(STATE["recent"])
+    events.reverse()
+    return events
+
+
+REPORT_BATCH = 500  # registros por HGETALL en pipeline / por chunk de /report
+
+
+def iter_deliveries() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Recorre los registros de entrega (e164, info) por tandas, sin armar
+    el dict completo en memoria.
+    """
+    if R is not None:
+        keys = R.scan_iter(match="delivery:+*", count=1000)
+        while True:
+            batch = list(islice(keys, REPORT_BATCH))
+            if not batch:
+                return
+            pipe = R.pipeline(transaction=False)
+            for key in batch:
+                pipe.hgetall(key)
+            for key, info in zip(batch, pipe.execute()):
+                if not info:
+                    continue  # se borró entre el SCAN y el HGETALL
+                if "vars" in info:
+                    info["vars"] = orjson.loads(info["vars"])
+                yield key[len("delivery:"):], info
+        return
+
+    with STATE_LOCK:
+        records = list(STATE["delivery"].items())
+    for e164, record in records:
+        yield e164, record.to_dict()
+
+
+def report_lists() -> Dict[str, List[str]]:
+    """delivered / failed / pending para /report, sin recorrer delivery."""
+    if R is not None:
+        pipe = R.pipeline(transaction=False)
+        for key in REPORT_SETS.values():
+            pipe.smembers(key)
+        return {name: sorted(members) for name, members in zip(REPORT_SETS, pipe.execute())}
+
+    with STATE_LOCK:
+        lists = {name: list(members) for name, members in STATE["report"].items()}
+    # mismo orden estable que Redis; se ordena fuera del lock
+    return {name: sorted(members) for name, members in lists.items()}
+
+
+# /status-detail: cache-aside del fetch a Twilio (en Redis: msg:{sid})
+MSG_CACHE_TTL = 60  # el status todavía puede cambiar
+MSG_CACHE_TTL_FINAL = 86400  # ya no cambia
+MSG_CACHE_MAX = 10_000
+_msg_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_msg_cache_lock = threading.Lock()
+
+
+def get_cached_message(sid: str) -> Optional[str]:
+    """JSON cacheado de /status-detail/<sid>, o None."""
+    if R is not None:
+        try:
+            return R.get(f"msg:{sid}")
+        except redis.RedisError:
+            return None
+
+    with _msg_cache_lock:
+        hit = _msg_cache.get(sid)
+        if hit is None:
+            return None
+        expires_at, body = hit
+        if expires_at < time.monotonic():
+            del _msg_cache[sid]
+            return None
+        return body
+
+
+def cache_message(sid: str, status: Optional[str], body: str) -> None:
+    ttl = MSG_CACHE_TTL_FINAL if status in FINAL_STATUSES else MSG_CACHE_TTL
+    if R is not None:
+        try:
+            R.set(f"msg:{sid}", body, ex=ttl)
+        except redis.RedisError:
+            pass
+        return
+
+    with _msg_cache_lock:
+        _msg_cache[sid] = (time.monotonic() + ttl, body)
+        _msg_cache.move_to_end(sid)
+        if len(_msg_cache) > MSG_CACHE_MAX:
+            _msg_cache.popitem(last=False)
+
+
+def msg_cache_stats() -> Dict[str, Any]:
+    """Tamaño/config del cache de /status-detail (en Redis sólo la config)."""
+    if R is not None:
+        return {"backend": "redis", "ttl": MSG_CACHE_TTL, "ttl_final": MSG_CACHE_TTL_FINAL}
+    with _msg_cache_lock:
+        size = len(_msg_cache)
+    return {
+        "backend": "memory",
+        "size": size,
+        "maxsize": MSG_CACHE_MAX,
+        "ttl": MSG_CACHE_TTL,
+        "ttl_final": MSG_CACHE_TTL_FINAL,
+    }
+
+
+def clear_msg_cache() -> int:
+    """Vacía el cache de /status-detail; devuelve cuántas entradas borró."""
+    if R is not None:
+        removed = 0
+        keys = R.scan_iter(match="msg:*", count=1000)  # SM... y MM... (media)
+        while batch := list(islice(keys, REPORT_BATCH)):
+            removed += R.unlink(*batch)
+        return removed
+
+    with _msg_cache_lock:
+        removed = len(_msg_cache)
+        _msg_cache.clear()
+    return removed
+
+
+def first_status_delivery(sid: str, status: str) -> bool:
+    """
+    True la primera vez que llega (sid, status). Twilio reintenta el
+    webhook si no recibe 200 a tiempo; los reintentos devuelven False.
+    """
+    if R is not None:
+        try:
+            return bool(R.set(f"twilio:status:{sid}:{status}", 1, nx=True, ex=STATUS_SEEN_TTL))
+        except redis.RedisError:
+            return True  # sin Redis no bloqueamos el webhook
+
+    key = (sid, status)
+    with _status_seen_lock:
+        if key in _status_seen:
+            return False
+        _status_seen[key] = None
+        if len(_status_seen) > STATUS_SEEN_MAX:
+            _status_seen.popitem(last=False)
+    return True
+
+
+# Jobs de lotes en segundo plano (en Redis: job:{id}, lo ve cualquier worker)
+JOB_TTL = 86400
+JOBS_MAX = 1_000
+_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def save_job(job_id: str, info: Dict[str, Any]) -> None:
+    if R is not None:
+        R.set(f"job:{job_id}", json_dumps(info), ex=JOB_TTL)
+        return
+
+    with _jobs_lock:
+        _jobs[job_id] = info
+        _jobs.move_to_end(job_id)
+        if len(_jobs) > JOBS_MAX:
+            _jobs.popitem(last=False)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    if R is not None:
+        raw = R.get(f"job:{job_id}")
+        return orjson.loads(raw) if raw else None
+
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+# =========================
+#   ENVÍO TWILIO
+# =========================
+WHATSAPP_PREFIX = "whatsapp:"  # To = WHATSAPP_PREFIX + e164
+
+
+# Parámetros fijos de todo envío (remitente + callback). El env no cambia
+# en runtime, así que se resuelven una vez y no por número.
+if MSG_SERVICE_SID:
+    SEND_BASE_PARAMS: Optional[Dict[str, str]] = {"MessagingServiceSid": MSG_SERVICE_SID}
+elif FROM_WHATSAPP:
+    SEND_BASE_PARAMS = {"From": FROM_WHATSAPP}
+else:
+    SEND_BASE_PARAMS = None  # cada envío falla con el error de configuración
+if SEND_BASE_PARAMS is not None and STATUS_CALLBACK_URL:
+    SEND_BASE_PARAMS["StatusCallback"] = STATUS_CALLBACK_URL
+
+
+@lru_cache(maxsize=4096)
+def _vars_json(items: Tuple[Tuple[str, str], ...]) -> str:
+    return json_dumps(dict(items))
+
+
+def content_variables_json(content_variables: Any) -> str:
+    """
+    ContentVariables serializado. En un lote muchas filas repiten las mismas
+    vars (p.ej. misma dependencia): se serializa una vez por combinación.
+    Sólo se cachea si todo es str: 1, True y 1.0 son la misma llave del
+    cache pero no el mismo JSON.
+    """
+    if isinstance(content_variables, dict) and all(
+        type(k) is str and type(v) is str for k, v in content_variables.items()
+    ):
+        return _vars_json(tuple(sorted(content_variables.items())))
+    return json_dumps(content_variables)
+
+
+def _retry_delay(resp: requests.Response, attempt: int) -> float:
+    retry_after = resp.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), TWILIO_429_BACKOFF_MAX)
+    return min(2 ** attempt * 0.25, TWILIO_429_BACKOFF_MAX) + random.uniform(0, 0.25)
 
 
 def send_one_whatsapp_template(
     to_e164: str,
     content_sid: str,
     content_variables: Optional[Dict[str, Any]],
-    status_callback_url: Optional[str],
 ) -> str:
     """
     Envía WhatsApp usando PLANTILLA (Content API).
     NO usa Twilio Lookup.
     """
-    import json
+    if SEND_BASE_PARAMS is None:
+        raise RuntimeError("Configura TWILIO_WHATSAPP_FROM=whatsapp:+52xxxxxxxxxx en .env")
 
-    kwargs: Dict[str, Any] = {
-        "to": with_whatsapp_prefix(to_e164),
-        "content_sid": content_sid,
+    params: Dict[str, Any] = {
+        "To": WHATSAPP_PREFIX + to_e164,
+        "ContentSid": content_sid,
+        **SEND_BASE_PARAMS,
     }
-
     if content_variables:
-        kwargs["content_variables"] = json.dumps(content_variables)
+        params["ContentVariables"] = content_variables_json(content_variables)
 
-    if status_callback_url:
-        kwargs["status_callback"] = status_callback_url
+    for attempt in range(TWILIO_429_RETRIES + 1):
+        wait_send_slot()  # cada reintento también cuenta contra TWILIO_MPS
+        resp = HTTP.post(TWILIO_MESSAGES_URL, data=params, timeout=TWILIO_HTTP_TIMEOUT)
+        if resp.status_code != 429 or attempt == TWILIO_429_RETRIES:
+            break
+        time.sleep(_retry_delay(resp, attempt))
+
+    if resp.status_code >= 400:
+        # mismo error que levantaría client.messages.create(...)
+        try:
+            payload = resp.json()
+        except ValueError:
+            payload = {}
+        raise TwilioRestException(
+            resp.status_code,
+            TWILIO_MESSAGES_URL,
+            f"Unable to create record: {payload.get('message', resp.text)}",
+            payload.get("code", resp.status_code),
+            "POST",
+            payload.get("details"),
+        )
+    return resp.json()["sid"]
+
+
+def process_lote(content_sid: str, row: LoteRow) -> Dict[str, Any]:
+    """
+    Corre en SEND_EXECUTOR: envía un lote y devuelve un resultado etiquetado
+    ({"ok": True, ...} o {"ok": False, "reason": ...}); nunca lanza.
+    Un envío OK se registra aquí mismo, apenas Twilio responde, para que el
+    callback de status ya encuentre el sid.
+    """
+    raw_str, e164, vars_lote = row
+    try:
+        sid = send_one_whatsapp_template(e164, content_sid, vars_lote)
+    except Exception as ex:
+        # 429 aun después de los reintentos: se agotó el cupo, no es el número
+        rate_limited = isinstance(ex, TwilioRestException) and ex.status == 429
+        return {
+            "ok": False,
+            "raw": raw_str,
+            "e164": e164,
+            "vars": vars_lote,
+            "status": "rate_limited" if rate_limited else "failed_on_send",
+            "reason": str(ex),
+        }
+    try:
+        track_delivery(
+            e164,
+            DeliveryRecord(status="queued", sid=sid, template=content_sid, vars=vars_lote),
+            sid=sid,
+        )
+    except Exception:
+        # el mensaje ya salió: un fallo del estado (Redis caído, pool agotado)
+        # no lo convierte en failed_on_send (el cliente lo reenviaría)
+        app.logger.exception("No se pudo registrar el envío %s a %s", sid, e164)
+    return {"ok": True, "raw": raw_str, "e164": e164, "sid": sid}
+
+
+def failed_delivery_write(content_sid: str, res: Dict[str, Any]) -> DeliveryWrite:
+    """Registro de entrega para un resultado fallido de process_lote."""
+    record = DeliveryRecord(
+        status=res["status"],
+        reason=res["reason"],
+        template=content_sid,
+        vars=res["vars"],
+    )
+    return res["e164"], record, None
+
+
+def failed_on_send_item(res: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "numero": res["raw"],
+        "e164": res["e164"],
+        "status": res["status"],
+        "reason": res["reason"],
+    }
+
+
+def iter_send_results(
+    content_sid: str,
+    rows: List[LoteRow],
+    heartbeat: Optional[float] = None,
+) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Único camino de envío de los lotes (bulk, background y SSE): envía los
+    rows ya normalizados en paralelo (SEND_EXECUTOR + token bucket) y produce
+    el resultado de process_lote de cada uno, en el orden de entrada.
+    Va por ventanas de SEND_WINDOW rows: no se encolan miles de futures de
+    golpe y, si una ventana termina con muchos 429, se espera antes de la
+    siguiente. Los fallidos se registran juntos al final (un pipeline).
+    Con heartbeat, produce None cada `heartbeat` s sin resultados (keep-alive).
+    """
+    failed_writes: List[DeliveryWrite] = []
+    backoff = 0.0
+    try:
+        for start in range(0, len(rows), SEND_WINDOW):
+            if backoff:
+                time.sleep(backoff)
+            futures = [
+                SEND_EXECUTOR.submit(process_lote, content_sid, row)
+                for row in rows[start:start + SEND_WINDOW]
+            ]
+            rate_limited = 0
+            for future in futures:
+                while True:
+                    try:
+                        res = future.result(timeout=heartbeat)
+                        break
+                    except FutureTimeoutError:
+                        yield None
+                if not res["ok"]:
+                    rate_limited += res["status"] == "rate_limited"
+                    failed_writes.append(failed_delivery_write(content_sid, res))
+                yield res
+            # Twilio sigue con 429 pese a los reintentos: frenar antes de la
+            # siguiente ventana (y volver a velocidad normal cuando se calme)
+            if rate_limited > SEND_WINDOW_429_RATIO * SEND_WINDOW:
+                backoff = min(max(backoff * 2, 1.0), TWILIO_429_BACKOFF_MAX)
+            else:
+                backoff = 0.0
+    finally:
+        track_deliveries(failed_writes)
+
+
+def send_rows(
+    content_sid: str,
+    rows: List[LoteRow],
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Envía los rows (ver iter_send_results). Devuelve (queued, failed_on_send)."""
+    queued: List[str] = []            # enviados correctamente a Twilio
+    failed_on_send: List[Dict[str, Any]] = []  # Twilio los rechazó (ej. 20003)
+    for res in iter_send_results(content_sid, rows):
+        if res["ok"]:
+            queued.append(res["raw"])
+        else:
+            failed_on_send.append(failed_on_send_item(res))
+    return queued, failed_on_send
+
+
+def run_bulk_job(job: Dict[str, Any], content_sid: str, rows: List[LoteRow]) -> None:
+    """Corre en JOB_EXECUTOR: envía el lote y guarda el resultado del job."""
+    try:
+        queued, failed_on_send = send_rows(content_sid, rows)
+    except Exception as ex:
+        save_job(job["job_id"], {**job, "status": "error", "error": str(ex)})
+        return
+    save_job(
+        job["job_id"],
+        {**job, "status": "done", "queued": queued, "failed_on_send": failed_on_send},
+    )
+
+
+def read_bulk_request() -> Tuple[Dict[str, Any], str, List[Dict[str, Any]]]:
+    """
+    Body de los endpoints de lote -> (data, content_sid, lotes).
+    Lanza ValueError con el mensaje del 400.
+    """
+    try:
+        data = read_json_body()
+    except orjson.JSONDecodeError:
+        raise ValueError("JSON inválido") from None
+    content_sid: str = (data.get("content_sid") or "").strip()
+    lotes: List[Dict[str, Any]] = data.get("lotes") or []
+
+    if not content_sid:
+        raise ValueError("Falta 'content_sid'")
+    if not isinstance(lotes, list) or not lotes:
+        raise ValueError("Falta lista 'lotes'")
+    return data, content_sid, lotes
 
-    if MSG_SERVICE_SID:
-        kwargs["messaging_service_sid"] = MSG_SERVICE_SID
-    else:
-        if not FROM_WHATSAPP:
-            raise RuntimeError("Configura TWILIO_WHATSAPP_FROM=whatsapp:+52xxxxxxxxxx en .env")
-        kwargs["from_"] = FROM_WHATSAPP
 
-    msg = client.messages.create(**kwargs)
-    return msg.sid
+# body > MAX_CONTENT_LENGTH (lo levanta Werkzeug al leer el body)
+@app.errorhandler(413)
+def payload_too_large(e):
+    return jsonify(error="Body demasiado grande", max_bytes=request.max_content_length), 413
 
 
 # =========================
@@ -131,73 +1012,52 @@ def send_template_bulk_personalizado():
           "vars": { "1": "Nombre", "2": "Dependencia" }
         },
         ...
-      ]
+      ],
+      "background": false
     }
+    Con "background": true responde 202 con un job_id al terminar de
+    normalizar; el envío sigue en segundo plano y el resultado se consulta
+    en /report?job=<job_id>.
     """
-    data = request.get_json(force=True, silent=True) or {}
-    content_sid: str = (data.get("content_sid") or "").strip()
-    lotes: List[Dict[str, Any]] = data.get("lotes") or []
-
-    if not content_sid:
-        return jsonify(error="Falta 'content_sid'"), 400
-    if not isinstance(lotes, list) or not lotes:
-        return jsonify(error="Falta lista 'lotes'"), 400
-
-    base = valid_public_base()
-    status_callback_url = f"{base}/twilio/status" if base else None
-
-    invalid_by_norm: List[str] = []   # errores al normalizar número
-    queued: List[str] = []            # enviados correctamente a Twilio
-    failed_on_send: List[Dict[str, Any]] = []  # Twilio los rechazó (ej. 20003)
-
-    for lote in lotes:
-        raw_str = str(lote.get("telefono", "")).strip()
-        vars_lote = lote.get("vars") or {}
-
-        if not raw_str:
-            continue
+    try:
+        data, content_sid, lotes = read_bulk_request()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
 
-        # 1) Normalizar simple a E.164 MX
-        try:
-            e164 = normalize_to_e164_mx(raw_str)
-        except ValueError as e:
-            invalid_by_norm.append(f"{raw_str} ({e})")
-            continue
+    # 1) Normalizar simple a E.164 MX (barato, antes de tocar la red)
+    # (un E.164 repetido se envía una sola vez)
+    rows, invalid_by_norm, duplicates_collapsed = normalize_lotes(lotes)
 
-        # 2) Enviar a Twilio
-        try:
-            sid = send_one_whatsapp_template(e164, content_sid, vars_lote, status_callback_url)
-            STATE["sid_to_number"][sid] = e164
-            STATE["delivery"][e164] = {
-                "status": "queued",
-                "sid": sid,
-                "channel": "whatsapp",
-                "template": content_sid,
-                "vars": vars_lote,
-            }
-            queued.append(raw_str)
-        except Exception as ex:
-            err_str = str(ex)
-            STATE["delivery"][e164] = {
-                "status": "failed_on_send",
-                "reason": err_str,
-                "channel": "whatsapp",
-                "template": content_sid,
-                "vars": vars_lote,
+    # "background": true -> 202 con job_id; el resultado sale en /report?job=
+    if data.get("background") is True:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "content_sid": content_sid,
+            "total": len(rows),
+            "invalid_by_norm": invalid_by_norm,
+            "duplicates_collapsed": duplicates_collapsed,
+        }
+        save_job(job_id, {**job, "status": "running"})
+        JOB_EXECUTOR.submit(run_bulk_job, job, content_sid, rows)
+        return jsonify(
+            {
+                "debug": "SEND-TEMPLATE-BULK-PERSONALIZADO v5",
+                **job,
+                "status": "running",
+                "report": f"/report?job={job_id}",
             }
-            failed_on_send.append(
-                {
-                    "numero": raw_str,
-                    "e164": e164,
-                    "reason": err_str,
-                }
-            )
+        ), 202
+
+    # 2) Enviar a Twilio en paralelo
+    queued, failed_on_send = send_rows(content_sid, rows)
 
     return jsonify(
         {
             "debug": "SEND-TEMPLATE-BULK-PERSONALIZADO v5",
             "received": data,
             "invalid_by_norm": invalid_by_norm,
+            "duplicates_collapsed": duplicates_collapsed,
             "queued": queued,
             "failed_on_send": failed_on_send,
             "note": "SIN Twilio Lookup, normalización MX simple.",
@@ -205,71 +1065,246 @@ def send_template_bulk_personalizado():
     ), 200
 
 
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json_dumps(data)}\n\n"
+
+
+@app.route("/send-template-bulk-personalizado/stream", methods=["POST"])
+def send_template_bulk_personalizado_stream():
+    """
+    Mismo body que /send-template-bulk-personalizado, pero responde con
+    Server-Sent Events conforme Twilio contesta cada envío:
+      event: start   -> total, invalid_by_norm, duplicates_collapsed
+      event: result  -> uno por número (en orden de entrada)
+      event: done    -> conteo final
+    Cada SSE_HEARTBEAT_SECONDS sin resultados manda un comentario de
+    keep-alive para que proxies no corten la conexión.
+    """
+    try:
+        _, content_sid, lotes = read_bulk_request()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    rows, invalid_by_norm, duplicates_collapsed = normalize_lotes(lotes)
+    results = iter_send_results(content_sid, rows, heartbeat=SSE_HEARTBEAT_SECONDS)
+
+    def generate() -> Iterator[str]:
+        queued = failed = 0
+        try:
+            yield _sse(
+                "start",
+                {
+                    "total": len(rows),
+                    "invalid_by_norm": invalid_by_norm,
+                    "duplicates_collapsed": duplicates_collapsed,
+                },
+            )
+            for res in results:
+                if res is None:
+                    yield ": ping\n\n"
+                elif res["ok"]:
+                    queued += 1
+                    yield _sse(
+                        "result",
+                        {"numero": res["raw"], "e164": res["e164"], "ok": True, "sid": res["sid"]},
+                    )
+                else:
+                    failed += 1
+                    yield _sse("result", {**failed_on_send_item(res), "ok": False})
+            yield _sse("done", {"queued": queued, "failed_on_send": failed})
+        finally:
+            # cliente desconectado: terminar de enviar lo que falta (y
+            # registrar los fallidos)
+            for _ in results:
+                pass
+
+    return Response(
+        generate(),
+        200,
+        {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        mimetype="text/event-stream",
+    )
+
+
 # =========================
 #   STATUS / REPORTES
 # =========================
+# Los callbacks de status se encolan y un solo hilo los aplica (dedupe +
+# apply_status) en orden de llegada: el webhook responde sin esperar al
+# lock de STATE ni a Redis. None en la cola = detener el hilo.
+StatusUpdate = Tuple[str, Optional[str], Optional[str], Optional[str]]  # (sid, status, code, msg)
+_status_q: "SimpleQueue[Optional[StatusUpdate]]" = SimpleQueue()
+_status_worker: Optional[threading.Thread] = None
+_status_worker_lock = threading.Lock()
+
+# Ventana de coalescencia: lo que llega en STATUS_COALESCE_SECONDS se aplica
+# junto y por sid sólo el último status (queued -> sent -> delivered en
+# ráfaga = una escritura). Los status descartados tampoco llegan a la
+# ventana "recent" de /report. 0 = aplicar (y registrar) cada callback.
+STATUS_COALESCE_SECONDS = float(os.getenv("STATUS_COALESCE_MS") or 200) / 1000
+
+# Un callback de status pesa ~1 KB: más que esto es basura y se corta (413)
+# antes de leerlo, sin pasar por el MAX_CONTENT_LENGTH general de los lotes.
+STATUS_MAX_BODY = 4096
+
+
+def _apply_status_update(update: StatusUpdate) -> None:
+    sid, status, error_code, error_msg = update
+    try:
+        if first_status_delivery(sid, status):
+            apply_status(sid, status, error_code, error_msg)
+    except Exception:
+        app.logger.exception("No se pudo aplicar el status %s de %s", status, sid)
+
+
+def _status_consumer() -> None:
+    while True:
+        update = _status_q.get()
+        if update is None:
+            return
+        if STATUS_COALESCE_SECONDS <= 0:
+            _apply_status_update(update)
+            continue
+
+        # sid -> último update; el dict conserva el orden del primero
+        window: Dict[str, StatusUpdate] = {update[0]: update}
+        stop = False
+        deadline = time.monotonic() + STATUS_COALESCE_SECONDS
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                update = _status_q.get(timeout=remaining)
+            except Empty:
+                break
+            if update is None:
+                stop = True
+                break
+            window[update[0]] = update
+        for update in window.values():
+            _apply_status_update(update)
+        if stop:
+            return
+
+
+def enqueue_status(update: StatusUpdate) -> None:
+    """Encola un callback de status; arranca el hilo consumidor si hace falta."""
+    global _status_worker
+    # Arranque perezoso: con preload_app el módulo se importa en el master de
+    # gunicorn y los hilos no sobreviven al fork; cada worker arranca el suyo.
+    if _status_worker is None or not _status_worker.is_alive():
+        with _status_worker_lock:
+            if _status_worker is None or not _status_worker.is_alive():
+                _status_worker = threading.Thread(
+                    target=_status_consumer, name="twilio-status", daemon=True
+                )
+                _status_worker.start()
+    _status_q.put(update)
+
+
+@atexit.register
+def _stop_status_worker() -> None:
+    # al apagar, terminar de aplicar lo que ya estaba en la cola
+    if _status_worker is not None and _status_worker.is_alive():
+        _status_q.put(None)
+        _status_worker.join(timeout=5)
+
+
 @app.route("/twilio/status", methods=["POST"])
 def twilio_status():
-    sid = request.form.get("MessageSid")
-    status = request.form.get("MessageStatus")
-    error_code = request.form.get("ErrorCode")
-    error_msg = request.form.get("ErrorMessage")
-
-    e164 = STATE["sid_to_number"].get(sid)
-    if e164:
-        prev = STATE["delivery"].get(e164, {})
-        prev.update({"status": status, "sid": sid})
-        if error_code or error_msg:
-            prev["error_code"] = error_code
-            prev["error_message"] = error_msg
-        STATE["delivery"][e164] = prev
+    # Es el endpoint más caliente (un callback por status por mensaje):
+    # se parsea el body urlencoded directo, sin armar el MultiDict de form.
+    request.max_content_length = STATUS_MAX_BODY
+    # Twilio firma todos los parámetros, también los vacíos (ej. ErrorCode=):
+    # se conservan para la firma y se descartan al leer los campos.
+    form = dict(parse_qsl(request.get_data(as_text=True), keep_blank_values=True))
+    if STATUS_SIGNATURE_VALIDATOR is not None and not STATUS_SIGNATURE_VALIDATOR.validate(
+        STATUS_CALLBACK_URL, form, request.headers.get("X-Twilio-Signature", "")
+    ):
+        return ("", 403)
+    sid = form.get("MessageSid") or None
+    status = form.get("MessageStatus") or None
+    error_code = form.get("ErrorCode") or None
+    error_msg = form.get("ErrorMessage") or None
+
+    if sid:
+        enqueue_status((sid, status, error_code, error_msg))
+
+    # Twilio acepta cualquier 2xx; 204 = sin body que armar ni mandar
+    return ("", 204)
 
-    return ("", 200)
+
+def _report_chunks(
+    lists: Dict[str, List[str]],
+    recent: List[Dict[str, Any]],
+    deliveries: Iterator[Tuple[str, Dict[str, Any]]],
+    last_summary: Dict[str, Any],
+) -> Iterator[bytes]:
+    # El JSON se arma a mano: "raw" sale por tandas de REPORT_BATCH
+    # registros en vez de serializar todo el dict de una vez.
+    dumps = orjson.dumps
+    yield (
+        b'{"delivered":' + dumps(lists["delivered"])
+        + b',"failed_or_undelivered":' + dumps(lists["failed"])
+        + b',"pending":' + dumps(lists["pending"])
+        + b',"recent":' + dumps(recent)
+        + b',"raw":{'
+    )
+    parts: List[bytes] = []
+    sep = b""
+    for e164, info in deliveries:
+        parts.append(sep + dumps(e164) + b":" + dumps(info))
+        sep = b","
+        if len(parts) >= REPORT_BATCH:
+            yield b"".join(parts)
+            parts.clear()
+    if parts:
+        yield b"".join(parts)
+    yield b'},"last_summary":' + dumps(last_summary) + b"}"
 
 
 @app.route("/report", methods=["GET"])
 def report():
-    delivered = []
-    failed = []
-    pending = []
-    for e164, info in STATE["delivery"].items():
-        st = (info or {}).get("status", "")
-        if st in ("delivered",):
-            delivered.append(e164)
-        elif st in ("failed", "undelivered", "failed_on_send"):
-            failed.append(e164)
-        else:
-            pending.append(e164)
+    job_id = request.args.get("job")
+    if job_id:
+        job = get_job(job_id)
+        if job is None:
+            return jsonify(error="Job no encontrado", job_id=job_id), 404
+        return jsonify(job), 200
 
-    return jsonify(
-        {
-            "delivered": delivered,
-            "failed_or_undelivered": failed,
-            "pending": pending,
-            "raw": STATE["delivery"],
-            "last_summary": STATE.get("last_summary", {}),
-        }
-    ), 200
+    lists = report_lists()
+    chunks = _report_chunks(
+        lists, recent_events(), iter_deliveries(), STATE.get("last_summary", {})
+    )
+    return Response(chunks, 200, mimetype="application/json")
 
 
 @app.route("/status-detail/<sid>", methods=["GET"])
 def status_detail(sid):
+    cached = get_cached_message(sid)
+    if cached is not None:
+        return cached, 200, {"Content-Type": "application/json"}
+
     try:
         msg = client.messages(sid).fetch()
-        return jsonify(
-            {
-                "sid": msg.sid,
-                "status": msg.status,
-                "to": msg.to,
-                "from": msg.from_,
-                "error_code": msg.error_code,
-                "error_message": msg.error_message,
-                "date_sent": str(msg.date_sent) if msg.date_sent else None,
-            }
-        ), 200
     except Exception as e:
         return jsonify(error=str(e)), 400
 
+    body = app.json.dumps(
+        {
+            "sid": msg.sid,
+            "status": msg.status,
+            "to": msg.to,
+            "from": msg.from_,
+            "error_code": msg.error_code,
+            "error_message": msg.error_message,
+            "date_sent": str(msg.date_sent) if msg.date_sent else None,
+        }
+    )
+    cache_message(sid, msg.status, body)
+    return body, 200, {"Content-Type": "application/json"}
+
 
 # =========================
 #   OTROS
@@ -281,157 +1316,79 @@ def health():
         ok=True,
         app="whatsapp-bulk",
         version=BACKEND_VERSION,
+        state="redis" if R is not None else "memory",
         account_sid_last4=ACCOUNT_SID[-4:],
     ), 200
 
 
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(
+        normalize=_normalize_cached.cache_info()._asdict(),
+        content_variables=_vars_json.cache_info()._asdict(),
+        status_detail=msg_cache_stats(),
+    ), 200
+
+
+@app.route("/cache/clear", methods=["POST"])
+def cache_clear():
+    # Los lru_cache son por proceso: sólo se vacían en el worker que atiende
+    # este POST (el cache de /status-detail en Redis sí es compartido).
+    _normalize_cached.cache_clear()
+    _vars_json.cache_clear()
+    return jsonify(ok=True, status_detail_removed=clear_msg_cache()), 200
+
+
+# =========================
+#   TESTER
+# =========================
+# El HTML vive en resources/tester.html (fuera de static/: Flask no sirve
+# una copia cruda, sin la versión, en /static/). Se lee una vez al importar:
+# se le pega la versión (al cambiar de versión cambia también el ETag y los
+# navegadores la recargan), se comprime y se calcula el ETag.
+with app.open_resource("resources/tester.html") as f:
+    _TESTER_BYTES = f.read().replace(b"__BACKEND_VERSION__", BACKEND_VERSION.encode("utf-8"))
+_TESTER_ETAG = hashlib.md5(_TESTER_BYTES).hexdigest()
+_TESTER_HEADERS = {
+    "Content-Type": "text/html; charset=utf-8",
+    "ETag": f'"{_TESTER_ETAG}"',
+    "Cache-Control": "public, max-age=3600",
+    "Vary": "Accept-Encoding",
+}
+# Versión gzip, comprimida una vez (mtime=0: mismos bytes en cada arranque).
+# Otro ETag: es otra representación del mismo recurso.
+_TESTER_GZIP = gzip.compress(_TESTER_BYTES, 9, mtime=0)
+_TESTER_GZIP_ETAG = _TESTER_ETAG + "-gz"
+_TESTER_GZIP_HEADERS = {
+    **_TESTER_HEADERS,
+    "ETag": f'"{_TESTER_GZIP_ETAG}"',
+    "Content-Encoding": "gzip",
+}
+
+
 @app.route("/tester", methods=["GET"])
 def tester():
-    # HTML simple (sin f-string, sin formato) para evitar problemas de llaves.
-    html = """
-<!doctype html>
-<html lang="es">
-<head>
-  <meta charset="utf-8" />
-  <title>Tester — WhatsApp Bulk</title>
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <style>
-    :root { --ink:#222; --muted:#666; --accent:#2563eb; --bg:#f6f7fb; }
-    body{ font:14px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Arial; color:var(--ink); background:var(--bg); margin:0; }
-    .wrap{ max-width:980px; margin:32px auto; background:#fff; border-radius:12px; padding:20px;
-           box-shadow:0 10px 25px rgba(0,0,0,.06); }
-    h1{ font-size:20px; margin:0 0 12px; }
-    .row{ display:flex; gap:12px; flex-wrap:wrap; margin-bottom:10px; }
-    label{ font-weight:600; font-size:12px; color:var(--muted); display:block; margin-bottom:6px; }
-    select,input,textarea{ width:100%; padding:10px; border:1px solid #e5e7eb; border-radius:8px; font:inherit; }
-    textarea{ min-height:180px; font-family:ui-monospace,SFMono-Regular,Menlo,Consolas,monospace; }
-    .btns{ display:flex; gap:10px; flex-wrap:wrap; }
-    button{ padding:10px 14px; border-radius:8px; border:0; cursor:pointer; font-weight:600; }
-    .primary{ background:var(--accent); color:#fff; }
-    .ghost{ background:#eef2ff; color:#1e3a8a; }
-    pre{ background:#0b1020; color:#e6edf3; padding:14px; border-radius:8px; overflow:auto; max-height:55vh; }
-    small{ color:var(--muted); }
-  </style>
-</head>
-<body>
-  <div class="wrap">
-    <h1>Tester — WhatsApp Bulk</h1>
-    <p><small>Pega tu JSON, elige método y endpoint. Esto hace <code>fetch</code> directo a tu backend.</small></p>
-
-    <div class="row">
-      <div style="flex:1 1 140px;">
-        <label>Método</label>
-        <select id="method">
-          <option>POST</option>
-          <option>GET</option>
-        </select>
-      </div>
-      <div style="flex:1 1 240px;">
-        <label>Endpoint rápido</label>
-        <select id="quick">
-          <option value="/send-template-bulk-personalizado">/send-template-bulk-personalizado</option>
-          <option value="/report">/report</option>
-          <option value="/health">/health</option>
-          <option value="__custom">— Personalizado —</option>
-        </select>
-      </div>
-      <div style="flex:2 1 340px;">
-        <label>Endpoint (URL relativa)</label>
-        <input id="endpoint" value="/send-template-bulk-personalizado" />
-      </div>
-    </div>
-
-    <label>Body JSON (solo se envía si el método es POST)</label>
-    <textarea id="body"></textarea>
-
-    <div class="btns" style="margin-top:10px;">
-      <button class="ghost" id="loadTemplateBulk">Ejemplo: /send-template-bulk-personalizado</button>
-      <button class="primary" id="sendBtn">Enviar</button>
-    </div>
-
-    <p><small>Regla: token exige 2 variables ("1","2"). content_di exige 4 ("1"–"4").</small></p>
-
-    <h3>Respuesta</h3>
-    <pre id="out">{}</pre>
-  </div>
-
-  <script>
-    const methodEl = document.getElementById('method');
-    const quickEl  = document.getElementById('quick');
-    const endEl    = document.getElementById('endpoint');
-    const bodyEl   = document.getElementById('body');
-    const outEl    = document.getElementById('out');
-    const sendBtn  = document.getElementById('sendBtn');
-    const loadTemplateBulk = document.getElementById('loadTemplateBulk');
-
-    quickEl.addEventListener('change', () => {
-      const v = quickEl.value;
-      if (v === '__custom') return;
-      endEl.value = v;
-    });
-
-    loadTemplateBulk.addEventListener('click', () => {
-      methodEl.value = 'POST';
-      endEl.value = '/send-template-bulk-personalizado';
-      bodyEl.value = JSON.stringify({
-        "content_sid": "HX06db9b89b5a9653ad7d204bc5130930b",
-        "lotes": [
-          {
-            "telefono": "6142249654",
-            "vars": { "1": "Jaime Prueba", "2": "DIF" }
-          },
-          {
-            "telefono": "2463095291",
-            "vars": { "1": "David Campos", "2": "Tesoreria Municipal" }
-          },
-          {
-            "telefono": "6563023022",
-            "vars": { "1": "Raul Monares", "2": "Desarrollo Urbano" }
-          }
-        ]
-      }, null, 2);
-    });
-
-    sendBtn.addEventListener('click', async () => {
-      const method = methodEl.value.trim();
-      const endpoint = endEl.value.trim() || '/send-template-bulk-personalizado';
-      let init = { method, headers: {} };
-
-      if (method === 'POST') {
-        let payload = {};
-        try {
-          payload = bodyEl.value ? JSON.parse(bodyEl.value) : {};
-        } catch (e) {
-          outEl.textContent = "❌ JSON inválido en el body: " + e.message;
-          return;
-        }
-        init.headers['Content-Type'] = 'application/json';
-        init.body = JSON.stringify(payload);
-      }
-
-      outEl.textContent = "Enviando...";
-      try {
-        const res = await fetch(endpoint, init);
-        const text = await res.text();
-        try {
-          const json = JSON.parse(text);
-          outEl.textContent = JSON.stringify(json, null, 2);
-        } catch {
-          outEl.textContent = text;
-        }
-      } catch (err) {
-        outEl.textContent = "❌ Error de red: " + (err?.message || err);
-      }
-    });
-
-    
-    loadTemplateBulk.click();
-  </script>
-</body>
-</html>
-    """
-    return html, 200, {"Content-Type": "text/html; charset=utf-8"}
+    if request.accept_encodings["gzip"]:
+        etag, body, headers = _TESTER_GZIP_ETAG, _TESTER_GZIP, _TESTER_GZIP_HEADERS
+    else:
+        etag, body, headers = _TESTER_ETAG, _TESTER_BYTES, _TESTER_HEADERS
+    if request.if_none_match.contains(etag):
+        # con Cache-Control: la revalidación renueva la frescura (RFC 9111 §4.3.4)
+        return Response(
+            status=304,
+            headers={
+                "ETag": headers["ETag"],
+                "Cache-Control": headers["Cache-Control"],
+                "Vary": "Accept-Encoding",
+            },
+        )
+    # Response nuevo por request: Flask/Werkzeug pueden tocar sus headers.
+    return Response(body, 200, headers)
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Servidor de desarrollo de Werkzeug, sólo para pruebas locales.
+    # En producción: gunicorn -c gunicorn.conf.py app:app
+    if os.getenv("FLASK_ENV") == "production":
+        sys.exit("FLASK_ENV=production: usa gunicorn -c gunicorn.conf.py app:app")
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG") == "1")
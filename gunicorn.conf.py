@@ -0,0 +1,50 @@
+# Configuración de gunicorn para producción:
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# gthread: cada worker atiende varias peticiones con hilos; los envíos a
+# Twilio son I/O (HTTPS bloqueante), así que los hilos sí se solapan.
+# Sin Redis (REDIS_URL) cada worker tiene su propio STATE en memoria: los
+# callbacks de /twilio/status, /report y los jobs caerían en otro worker.
+# Por eso sin Redis se corre un solo worker (y no se arranca con más).
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()  # REDIS_URL puede venir del .env, como en app.py
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+_redis = bool((os.getenv("REDIS_URL") or "").strip())
+workers = int(os.getenv("GUNICORN_WORKERS") or (2 if _redis else 1))
+if workers > 1 and not _redis:
+    raise RuntimeError("GUNICORN_WORKERS > 1 requiere REDIS_URL (STATE en memoria es por worker)")
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS") or 64)
+
+# app.py se importa una vez en el master y los workers arrancan con fork.
+# Es seguro: los pools de hilos no crean hilos hasta el primer submit y
+# redis-py / requests no abren conexiones al importar (cada worker abre
+# las suyas).
+preload_app = True
+
+# keep-alive largo para el tráfico de webhooks de Twilio (mismo cliente)
+keepalive = 30
+# un lote grande puede tardar: TWILIO_MPS limita ~25 envíos/seg
+timeout = 120
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_exit(server):
+    # Snapshot antes de salir (redis.conf ya tiene AOF; esto cubre instancias
+    # configuradas sólo con RDB). Se pide aquí, una sola vez, desde el master
+    # al apagar: con preload_app un handler de SIGTERM en app.py lo pisaría
+    # gunicorn.
+    import app
+
+    if app.R is not None:
+        try:
+            app.R.bgsave()
+        except app.redis.RedisError:
+            pass